@@ -13,6 +13,11 @@ try:
 except ImportError:
     import time
 
+try:
+    import uselect as select
+except ImportError:
+    import select
+
 try:
     import ure as re
 except ImportError:
@@ -24,9 +29,87 @@ except ImportError:
     def const(v):
         return v
 
+# Bind the functions used on the hot paths to module-level names to skip the attribute lookup on every call
+_getaddrinfo = socket.getaddrinfo
+_socket = socket.socket
+_AF_INET = socket.AF_INET
+_SOCK_DGRAM = socket.SOCK_DGRAM
+_gmtime = time.gmtime
+_mktime = time.mktime
+_unpack_from = struct.unpack_from
+_pack_into = struct.pack_into
+# CPython on Windows has no poll(). Only ntp_time() needs it, so the rest of the module still works there
+_poll = getattr(select, 'poll', None)
+_POLLIN = getattr(select, 'POLLIN', 0)
+
+try:
+    _ticks_us = time.ticks_us
+    _ticks_ms = time.ticks_ms
+    _ticks_diff = time.ticks_diff
+    _ticks_add = time.ticks_add
+except AttributeError:
+    # CPython does not have the ticks functions. Fall back to a monotonic counter with the same resolution
+    def _ticks_us():
+        return time.monotonic_ns() // 1000
+
+    def _ticks_ms():
+        return time.monotonic_ns() // 1000_000
+
+    def _ticks_diff(ticks1, ticks2):
+        return ticks1 - ticks2
+
+    def _ticks_add(ticks, delta):
+        return ticks + delta
+
 _EPOCH_DELTA_1900_1970 = const(2208988800)  # Seconds between 1900 and 1970
 _EPOCH_DELTA_1900_2000 = const(3155673600)  # Seconds between 1900 and 2000
 _EPOCH_DELTA_1970_2000 = const(946684800)  # Seconds between 1970 and 2000 = _EPOCH_DELTA_1900_2000 - _EPOCH_DELTA_1900_1970
+_US_PER_S = const(1000_000)  # Microseconds in a second
+_HOST_BACKOFF_MAX_S = const(3600)  # Max time a failing host is skipped for. The time doubles on every consecutive failure
+_HOST_ADDR_TTL_MS = const(3600_000)  # How long a resolved host address is reused. The NTP pool rotates its addresses every hour
+_DRIFT_SAMPLES = const(8)  # How many of the last drift calculations are averaged when the drift tolerance is set
+
+# All valid (hour, minute) timezone offsets
+_VALID_TIMEZONES = frozenset([(hour, 0) for hour in range(-12, 15)] +
+                             [(hour, 30) for hour in (-9, -3, 3, 4, 5, 6, 9, 10)] +
+                             [(hour, 45) for hour in (5, 8, 12)])
+
+_NTP_MODE_MASK = const(0b00000111)  # Mode field in the first byte of the NTP header
+_NTP_MODE_SERVER = const(4)  # Mode value of a server response
+_NTP_LEAP_SHIFT = const(6)  # Leap indicator field is in the two most significant bits of the first byte of the NTP header
+# An NTP fraction is converted to microseconds with frac * 1000000 >> 32. As 1000000 = 15625 * 2**6,
+# the same exact result is computed with a smaller multiplier and intermediate value: frac * 15625 >> 26
+_NTP_FRAC_US_MUL = const(15625)
+_NTP_FRAC_US_SHIFT = const(26)
+
+# Compile the hostname validation pattern once at import
+_HOSTNAME_RE = re.compile(r'^(([a-zA-Z0-9]|[a-zA-Z0-9][a-zA-Z0-9_\-]*[a-zA-Z0-9])\.)*([A-Za-z0-9]|[A-Za-z0-9][A-Za-z0-9_\-]*[A-Za-z0-9])$')
+
+# Month offsets for Sakamoto's method, shifted by 6 days so that the result starts from Monday
+_WEEKDAY_MONTH_OFFSETS = (6, 2, 1, 4, 6, 2, 4, 0, 3, 5, 1, 3)
+
+
+def _weekday(year: int, month: int, day: int) -> int:
+    """ Sakamoto's method without any validation.
+
+    Returns:
+        int: 0(Mon) 1(Tue) 2(Wed) 3(Thu) 4(Fri) 5(Sat) to 6(Sun)
+    """
+
+    # January and February are counted as the last months of the previous year
+    year -= month < 3
+    return (year + year // 4 - year // 100 + year // 400 + _WEEKDAY_MONTH_OFFSETS[month - 1] + day) % 7
+
+
+# Days in every month of a non-leap year. Stored as bytes, which takes one byte per month instead of one pointer
+_MONTH_DAYS = bytes((31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31))
+
+
+def _days_in_month(year: int, month: int) -> int:
+    """ Same as Ntp.days_in_month(), but without validating the parameters. """
+
+    # February has an extra day in leap years. The result of the test is added as 0 or 1
+    return _MONTH_DAYS[month - 1] + (month == 2 and (year & 3) == 0 and (year % 100 != 0 or year % 400 == 0))
 
 
 class Ntp:
@@ -68,34 +151,58 @@ class Ntp:
 
     _log_callback = print  # Callback for message output
     _datetime_callback = None  # Callback for reading/writing the RTC
-    _hosts: list = []  # Array of hostnames or IPs
+    _datetime_getter = None  # Precision adjusted callback specialized for reading the RTC
+    _datetime_setter = None  # Precision adjusted callback specialized for writing the RTC
+    _hosts: tuple = ()  # Tuple of hostnames or IPs
+    _ntp_socket = None  # UDP socket shared by all the NTP requests. Created on first use
+    _ntp_sequence: int = 0  # Sequence number of the last NTP request. Used to match the responses with the requests
+    # The dicts and the list of the class state are never changed in place. They are replaced through cls on every change,
+    # so a subclass never changes the state of its base class
+    _host_addr_cache: dict = {}  # Resolved socket addresses of the hosts. Key = host, Value = 2-tuple(address, expiry in ticks_ms)
+    _host_backoff: dict = {}  # Failing hosts. Key = host, Value = 2-tuple(consecutive failures, skipped until in ticks_ms)
     _timezone: int = 0  # Timezone offset in seconds
     _rtc_last_sync: int = 0  # Last RTC synchronization timestamp. Uses device's epoch
     _drift_last_compensate: int = 0  # Last RTC drift compensation timestamp. Uses device's epoch
     _drift_last_calculate: int = 0  # Last RTC drift calculation timestamp. Uses device's epoch
     _ppm_drift: float = 0.0  # RTC drift
+    _ppm_scale: (float, None) = 0.0  # Cache _ppm_drift / (1000_000 + _ppm_drift) used by drift_us(). None if not calculated yet
+    _drift_tolerance_ppm = None  # Max standard deviation of the drift samples to accept their mean. None to use every calculation as it is
+    _drift_samples: list = []  # The last drift calculations in ppm, used when the drift tolerance is set
     _ntp_timeout_s: int = 1  # Network timeout when communicating with NTP servers
     _epoch = EPOCH_2000  # User selected epoch
-    _device_epoch = None  # The device's epoch
+    _epoch_delta_from_1900: int = -_EPOCH_DELTA_1900_2000  # Delta from the NTP epoch(1900) to the user selected epoch
+    # The device's epoch. The port can not change it at runtime, so it is probed once at import. None if the epoch is not supported
+    _device_epoch = {1900: EPOCH_1900, 1970: EPOCH_1970, 2000: EPOCH_2000}.get(_gmtime(0)[0])
+    _cached_default_epoch_delta = None  # Cache the delta from the device's epoch to the user selected epoch
+    _epoch_delta_cache_key = None  # The last epoch explicitly passed to _device_epoch_delta()
+    _epoch_delta_cache_val: int = 0  # The delta from the device's epoch to _epoch_delta_cache_key
 
     _dst_start: (tuple, None) = None  # (month, week, day of week, hour)
     _dst_end: (tuple, None) = None  # (month, week, day of week, hour)
     _dst_bias: int = 0  # Time bias in seconds
+    _dst_enabled: bool = False  # Cache whether start, end and bias are all set, so DST is in use
 
-    _dst_cache_switch_hours_start = None  # Cache the switch hour calculation
-    _dst_cache_switch_hours_end = None  # Cache the switch hour calculation
+    _dst_cache_switch_hours_start = None  # Cache the switch hour calculation. Hours since the beginning of the year
+    _dst_cache_switch_hours_end = None  # Cache the switch hour calculation. Hours since the beginning of the year
     _dst_cache_switch_hours_timestamp = None  # Cache the year, the last switch time calculation was made
+    _dst_cache_leap_day: int = 0  # Cache 1 if the year of the last switch time calculation is a leap year, 0 otherwise
+
+    _midnight_cache_year = None  # Cache the date of the last midnight calculation
+    _midnight_cache_month = None
+    _midnight_cache_day = None
+    _midnight_cache_secs: int = 0  # Cache the seconds since the device's epoch at midnight of the cached date
 
     # ========================================
     # Preallocate ram to prevent fragmentation
     # ========================================
-    __weekdays = (5, 6, 0, 1, 2, 3, 4)
-    __days = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+    __days_cum = (0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334)  # Days before the month in a non-leap year
     __ntp_msg = bytearray(48)
-    # Lookup Table for fast access. Row = from_epoch Column = to_epoch
-    __epoch_delta_lut = ((0, -_EPOCH_DELTA_1900_1970, -_EPOCH_DELTA_1900_2000),
-                         (_EPOCH_DELTA_1900_1970, 0, -_EPOCH_DELTA_1970_2000),
-                         (_EPOCH_DELTA_1900_2000, _EPOCH_DELTA_1970_2000, 0))
+    __ntp_request = b'\x1b' + bytes(47)  # NTP request template. LI = 0, Version = 3, Mode = 3 (client)
+    __ntp_request_msg = bytearray(48)  # NTP request, built from the template for every host
+    # Flat lookup table for fast access. Index = from_epoch * 3 + to_epoch
+    __epoch_delta_lut = (0, -_EPOCH_DELTA_1900_1970, -_EPOCH_DELTA_1900_2000,
+                         _EPOCH_DELTA_1900_1970, 0, -_EPOCH_DELTA_1970_2000,
+                         _EPOCH_DELTA_1900_2000, _EPOCH_DELTA_1970_2000, 0)
 
     @classmethod
     def set_datetime_callback(cls, callback, precision = SUBSECOND_PRECISION_US):
@@ -175,7 +282,22 @@ class Ntp:
 
             raise ValueError(f'Invalid parameters: {args}. In setter mode expects 8-tuple')
 
+        # The library only calls the getter and setter specializations. They skip the argument checks of the combined
+        # callback and with microsecond precision they access the RTC directly, without rebuilding the 8-tuple
+        if precision == cls.SUBSECOND_PRECISION_US:
+            getter = callback
+            setter = callback
+        else:
+            def getter():
+                dt = callback()
+                return dt[:7] + (dt[7] * precision,)
+
+            def setter(dt):
+                return callback(dt[:7] + (dt[7] // precision,))
+
         cls._datetime_callback = precision_adjusted_callback
+        cls._datetime_getter = getter
+        cls._datetime_setter = setter
 
     @classmethod
     def set_logger_callback(cls, callback = print):
@@ -234,6 +356,10 @@ class Ntp:
         else:
             raise ValueError('Invalid parameter: epoch={} must be a one of Ntp.EPOCH_1900, Ntp.EPOCH_1970, Ntp.EPOCH_2000 or None'.format(epoch))
 
+        # Cache the delta used to convert the NTP time to the default epoch
+        cls._epoch_delta_from_1900 = cls.__epoch_delta_lut[cls.EPOCH_1900 * 3 + cls._epoch]
+        cls._cached_default_epoch_delta = None
+
     @classmethod
     def get_epoch(cls):
         """ Get the default epoch
@@ -265,6 +391,7 @@ class Ntp:
             cls._dst_start = None
             cls._dst_end = None
             cls._dst_bias = 0
+            cls._dst_enabled = False
         elif not isinstance(start, tuple) or len(start) != 4:
             raise ValueError("Invalid parameter: start={} must be a 4-tuple(month, week, weekday, hour)".format(start))
         elif not isinstance(end, tuple) or len(end) != 4:
@@ -285,16 +412,12 @@ class Ntp:
             hour (int): integer in range 0 - 23
         """
 
-        if not isinstance(month, int) or not cls.MONTH_JAN <= month <= cls.MONTH_DEC:
-            raise ValueError("Invalid parameter: month={} must be a integer in (Ntp.MONTH_JAN ... Ntp.MONTH_DEC)".format(month))
-        elif not isinstance(week, int) or not cls.WEEK_FIRST <= week <= cls.WEEK_LAST:
-            raise ValueError("Invalid parameter: week={} must be a integer in (Ntp.WEEK_FIRST ... Ntp.WEEK_LAST)".format(week))
-        elif not isinstance(weekday, int) or not cls.WEEKDAY_MON <= weekday <= cls.WEEKDAY_SUN:
-            raise ValueError("Invalid parameter: weekday={} must be a integer in (Ntp.WEEKDAY_MON ... Ntp.WEEKDAY_SUN)".format(weekday))
-        elif not isinstance(hour, int) or not 0 <= hour <= 23:
-            raise ValueError("Invalid parameter: hour={} must be a integer between 0 and 23".format(hour))
+        cls._validate_dst_point(month, week, weekday, hour)
 
         cls._dst_start = (month, week, weekday, hour)
+        cls._dst_enabled = cls._dst_end is not None and cls._dst_bias != 0
+        # The cached switch hours were calculated with the old rule
+        cls._dst_cache_switch_hours_timestamp = None
 
     @classmethod
     def get_dst_start(cls):
@@ -317,16 +440,12 @@ class Ntp:
             hour (int): integer in range 0 - 23
         """
 
-        if not isinstance(month, int) or not cls.MONTH_JAN <= month <= cls.MONTH_DEC:
-            raise ValueError("Invalid parameter: month={} must be a integer in (Ntp.MONTH_JAN ... Ntp.MONTH_DEC)".format(month))
-        elif not isinstance(week, int) or not cls.WEEK_FIRST <= week <= cls.WEEK_LAST:
-            raise ValueError("Invalid parameter: week={} must be a integer in (Ntp.WEEK_FIRST ... Ntp.WEEK_LAST)".format(week))
-        elif not isinstance(weekday, int) or not cls.WEEKDAY_MON <= weekday <= cls.WEEKDAY_SUN:
-            raise ValueError("Invalid parameter: weekday={} must be a integer in (Ntp.WEEKDAY_MON ... Ntp.WEEKDAY_SUN)".format(weekday))
-        elif not isinstance(hour, int) or not 0 <= hour <= 23:
-            raise ValueError("Invalid parameter: hour={} must be a integer between 0 and 23".format(hour))
+        cls._validate_dst_point(month, week, weekday, hour)
 
         cls._dst_end = (month, week, weekday, hour)
+        cls._dst_enabled = cls._dst_start is not None and cls._dst_bias != 0
+        # The cached switch hours were calculated with the old rule
+        cls._dst_cache_switch_hours_timestamp = None
 
     @classmethod
     def get_dst_end(cls):
@@ -357,6 +476,7 @@ class Ntp:
 
         # Convert to seconds
         cls._dst_bias = bias * 60
+        cls._dst_enabled = cls._dst_start is not None and cls._dst_end is not None and bias != 0
 
     @classmethod
     def set_dst_time_bias(cls, bias: int):
@@ -388,7 +508,7 @@ class Ntp:
         """
 
         # Return 0 if DST is disabled
-        if cls._dst_start is None or cls._dst_end is None or cls._dst_bias == 0:
+        if not cls._dst_enabled:
             return 0
 
         # If a datetime tuple is passed, the DST will be calculated according to it otherwise read the current datetime
@@ -400,27 +520,7 @@ class Ntp:
             raise ValueError(
                 'Invalid parameter: dt={} must be a 8-tuple(year, month, day, weekday, hour, minute, second, subsecond)'.format(dt))
 
-        # Calculates and caches the hours since the beginning of the month when the DST starts/ends
-        if dt[0] != cls._dst_cache_switch_hours_timestamp or \
-                cls._dst_cache_switch_hours_start is None or \
-                cls._dst_cache_switch_hours_end is None:
-            cls._dst_cache_switch_hours_timestamp = dt[0]
-            cls._dst_cache_switch_hours_start = cls.weekday_in_month(dt[0], cls._dst_start[0], cls._dst_start[1], cls._dst_start[2]) * 24 + cls._dst_start[3]
-            cls._dst_cache_switch_hours_end = cls.weekday_in_month(dt[0], cls._dst_end[0], cls._dst_end[1], cls._dst_end[2]) * 24 + cls._dst_end[3]
-
-        # Condition 1: The current month is strictly within the DST period
-        # Condition 2: Current month is the month the DST period starts. Calculates the current hours since the beginning of the month
-        #              and compares it with the cached value of the hours when DST starts
-        # Condition 3: Current month is the month the DST period ends. Calculates the current hours since the beginning of the month
-        #              and compares it with the cached value of the hours when DST ends
-        # If one of the three conditions is True, the DST is in effect
-        if cls._dst_start[0] < dt[1] < cls._dst_end[0] or \
-                (dt[1] == cls._dst_start[0] and (dt[2] * 24 + dt[4]) >= cls._dst_cache_switch_hours_start) or \
-                (dt[1] == cls._dst_end[0] and (dt[2] * 24 + dt[4]) < cls._dst_cache_switch_hours_end):
-            return cls._dst_bias
-
-        # The current month is outside the DST period
-        return 0
+        return cls._dst(dt)
 
     @classmethod
     def set_ntp_timeout(cls, timeout_s: int = 1):
@@ -453,7 +553,23 @@ class Ntp:
             tuple: NTP servers
         """
 
-        return tuple(cls._hosts)
+        return cls._hosts
+
+    @classmethod
+    def host_health(cls):
+        """ Get the hosts which failed recently. A failing host is skipped for a while, which doubles on every
+        consecutive failure, up to an hour. If all the hosts are failing, all of them are queried anyway.
+
+        Returns:
+            dict: Key = host, Value = 2-tuple(consecutive failures, remaining skip time in milliseconds)
+        """
+
+        now_ms = _ticks_ms()
+        health = {}
+        for host, (failures, until_ms) in cls._host_backoff.items():
+            health[host] = (failures, _ticks_diff(until_ms, now_ms) if cls._host_backing_off(host) else 0)
+
+        return health
 
     @classmethod
     def set_hosts(cls, value: tuple):
@@ -463,11 +579,10 @@ class Ntp:
             value (tuple): NTP servers. Can contain hostnames or IP addresses
         """
 
-        cls._hosts.clear()
-
-        for host in value:
-            if cls._validate_host(host):
-                cls._hosts.append(host)
+        # Store the hosts as an immutable tuple, so get_hosts() can return it without a copy
+        cls._hosts = tuple([host for host in value if cls._validate_host(host)])
+        cls._host_addr_cache = {}
+        cls._host_backoff = {}
 
     @classmethod
     def get_timezone(cls):
@@ -494,12 +609,7 @@ class Ntp:
         if not isinstance(hour, int) or not isinstance(minute, int):
             raise ValueError('Invalid parameter: hour={}, minute={} must be integers'.format(hour, minute))
 
-        if (
-                (minute not in (0, 30, 45)) or
-                (minute == 0 and not (-12 <= hour <= 14)) or
-                (minute == 30 and hour not in (-9, -3, 3, 4, 5, 6, 9, 10)) or
-                (minute == 45 and hour not in (5, 8, 12))
-        ):
+        if (hour, minute) not in _VALID_TIMEZONES:
             raise ValueError('Invalid timezone for hour={} and minute={}'.format(hour, minute))
 
         cls._timezone = hour * 3600 + minute * 60
@@ -525,9 +635,9 @@ class Ntp:
         """
 
         # gmtime() uses the device's epoch
-        us = cls.time_us(cls.device_epoch(), utc = utc)
+        us = cls.time_us(cls.device_epoch(), utc)
         # (year, month, day, hour, minute, second, weekday, yearday) + (us,)
-        return time.gmtime(us // 1000_000) + (us % 1000_000,)
+        return _gmtime(us // _US_PER_S) + (us % _US_PER_S,)
 
     @classmethod
     def time_s(cls, epoch: int = None, utc: bool = False):
@@ -544,7 +654,7 @@ class Ntp:
             int: the time in seconds since the selected epoch
         """
 
-        return cls.time_us(epoch = epoch, utc = utc) // 1000_000
+        return cls._time_parts(epoch, utc)[0]
 
     @classmethod
     def time_ms(cls, epoch: int = None, utc: bool = False):
@@ -561,7 +671,8 @@ class Ntp:
             int: the time in milliseconds since the selected epoch
         """
 
-        return cls.time_us(epoch = epoch, utc = utc) // 1000
+        seconds, subsecond = cls._time_parts(epoch, utc)
+        return seconds * 1000 + subsecond // 1000
 
     @classmethod
     def time_us(cls, epoch: int = None, utc: bool = False):
@@ -578,24 +689,16 @@ class Ntp:
             int: the time in microseconds since the selected epoch
         """
 
-        # dt = (year, month, day, weekday, hour, minute, second, subsecond)
-        # index  0      1     2      3       4      5       6        7
-        dt = cls._datetime()
-
-        epoch_delta = cls.epoch_delta(cls.device_epoch(), epoch)
-
-        # Daylight Saving Time (DST) is not used for UTC as it is a time standard for all time zones.
-        timezone_and_dst = 0 if utc else (cls._timezone + cls.dst(dt))
-        # mktime() uses the device's epoch
-        return (time.mktime((dt[0], dt[1], dt[2], dt[4], dt[5], dt[6], 0, 0, 0)) + epoch_delta + timezone_and_dst) * 1000_000 + dt[7]
+        seconds, subsecond = cls._time_parts(epoch, utc)
+        return seconds * _US_PER_S + subsecond
 
     @classmethod
     def ntp_time(cls, epoch: int = None):
         """
             Retrieves the current UTC time from the first responsive NTP server in the provided server list with microsecond precision.
-            This method attempts to connect to NTP servers sequentially, based on the server list order, until a response is received or the list is exhausted.
+            This method sends a request to all the NTP servers in the list at once and uses the first valid response that arrives.
 
-            In case of a server timeout, defined by the class-level timeout setting (`set_ntp_timeout()`), the method proceeds to the next server in the list.
+            The method waits for a response up to the class-level timeout setting (`set_ntp_timeout()`), regardless of the number of servers.
             The default timeout is 1 sec. If no servers respond within the timeout period, the method raises an exception.
 
             The time received from the server is adjusted for network delay and converted to the specified epoch time format.
@@ -614,77 +717,129 @@ class Ntp:
                 RuntimeError: If unable to connect to any NTP server from the provided list.
 
             Note:
-                The function assumes that the list of NTP servers (`cls._hosts`), NTP message template (`cls.__ntp_msg`), and timeout setting (`cls._ntp_timeout_s`)
+                The function assumes that the list of NTP servers (`cls._hosts`), NTP message buffers (`cls.__ntp_msg`, `cls.__ntp_request_msg`), and timeout setting (`cls._ntp_timeout_s`)
                 are properly initialized in the class.
         """
 
-        if not any(cls._hosts):
+        if not cls._hosts:
             raise Exception('There are no valid Hostnames/IPs set for the time server')
 
-        # Clear the NTP request packet
-        cls.__ntp_msg[0] = 0x1B
-        for i in range(1, len(cls.__ntp_msg)):
-            cls.__ntp_msg[i] = 0
+        if _poll is None:
+            raise RuntimeError('select.poll() is not available on this platform')
+
+        # Bind the class attributes used inside the loops to locals. Local lookups are much cheaper than class attribute lookups
+        hosts = cls._hosts
+        msg = cls.__ntp_msg
+        request = cls.__ntp_request_msg
+        log = cls._log
+        timeout_ms = cls._ntp_timeout_s * 1000
+
+        # A single socket is kept open between the calls and is shared by all the hosts
+        s = cls._ntp_socket
+        if s is None:
+            s = cls._ntp_socket = _socket(_AF_INET, _SOCK_DGRAM)
+            s.setblocking(False)
+
+        # Every call gets a new non-zero sequence number, so a late response to a previous call is never accepted
+        sequence = cls._ntp_sequence % 0xFFFFFFFF + 1
+        cls._ntp_sequence = sequence
+
+        transmit_ts_us = [None] * len(hosts)  # Send time (T1) of the requests waiting for a response. Index = host index
+        waiting = 0
+
+        # Skip the hosts which failed recently. If all of them did, query all of them anyway
+        skip = [cls._host_backing_off(host) for host in hosts] if cls._host_backoff else None
+        if skip is not None and all(skip):
+            skip = None
+
+        # Send the request to all the hosts at once, so an unresponsive host does not delay the others by a full timeout
+        request[:] = cls.__ntp_request
+        for index, host in enumerate(hosts):
+            if skip is not None and skip[index]:
+                continue
 
-        for host in cls._hosts:
-            s = None
+            # The server copies the transmit timestamp of the request into the originate timestamp of its response.
+            # Put the sequence number and the host index there, to match every response with its request
+            _pack_into('!II', request, 40, sequence, index)
             try:
-                host_addr = socket.getaddrinfo(host, 123)[0][-1]
-                s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                s.settimeout(cls._ntp_timeout_s)
-                transmin_ts_us = time.ticks_us()  # Record send time (T1)
-                s.sendto(cls.__ntp_msg, host_addr)
-                s.readinto(cls.__ntp_msg)
-                receive_ts_us = time.ticks_us()  # Record receive time (T2)
+                host_addr = cls._resolve(host)
+                transmit_ts_us[index] = _ticks_us()  # Record send time (T1)
+                s.sendto(request, host_addr)
             except Exception as e:
-                cls._log('(NTP) Network error: Host({}) Error({})'.format(host, str(e)))
-                continue
-            finally:
-                if s is not None:
-                    s.close()
-
-            # Mode: The mode field of the NTP packet is an 8-bit field that specifies the mode of the packet.
-            # A value of 4 indicates a server response, so if the mode value is not 4, the packet is invalid.
-            if (cls.__ntp_msg[0] & 0b00000111) != 4:
-                cls._log('(NTP) Invalid packet due to bad "mode" field value: Host({})'.format(host))
-                continue
-
-            # Leap Indicator: The leap indicator field of the NTP packet is a 2-bit field that indicates the status of the server's clock.
-            # A value of 0 or 1 indicates a normal or unsynchronized clock, so if the leap indicator field is set to any other value, the packet is invalid.
-            if ((cls.__ntp_msg[0] >> 6) & 0b00000011) > 2:
-                cls._log('(NTP) Invalid packet due to bad "leap" field value: Host({})'.format(host))
-                continue
-
-            # Stratum: The stratum field of the NTP packet is an 8-bit field that indicates the stratum level of the server.
-            # A value outside the range 1 to 15 indicates an invalid packet.
-            if not (1 <= (cls.__ntp_msg[1]) <= 15):
-                cls._log('(NTP) Invalid packet due to bad "stratum" field value: Host({})'.format(host))
+                # The address may be stale. Resolve it again on the next request
+                transmit_ts_us[index] = None
+                cls._host_addr_drop(host)
+                cls._host_failed(host)
+                log('(NTP) Network error: Host({}) Error({})', host, e)
                 continue
 
-            # Extract T3 and T4 from the NTP packet
-            # Receive Timestamp (T3): The Receive Timestamp field of the NTP packet is a 64-bit field that contains the server's time when the packet was received.
-            srv_receive_ts_sec, srv_receive_ts_frac = struct.unpack('!II', cls.__ntp_msg[32:40])  # T3
-            # Transmit Timestamp (T4): The Transmit Timestamp field of the NTP packet is a 64-bit field that contains the server's time when the packet was sent.
-            srv_transmit_ts_sec, srv_transmit_ts_frac = struct.unpack('!II', cls.__ntp_msg[40:48])  # T4
+            waiting += 1
 
-            # If any of these fields is zero, it may indicate that the packet is invalid.
-            if srv_transmit_ts_sec == 0 or srv_receive_ts_sec == 0:
-                cls._log('(NTP) Invalid packet: Host({})'.format(host))
-                continue
-
-            # Convert T3 to microseconds
-            srv_receive_ts_us = srv_receive_ts_sec * 1_000_000 + (srv_receive_ts_frac * 1_000_000 >> 32)
-            # Convert T4 to microseconds
-            srv_transmit_ts_us = srv_transmit_ts_sec * 1_000_000 + (srv_transmit_ts_frac * 1_000_000 >> 32)
-            # Calculate network delay in microseconds
-            network_delay_us = (receive_ts_us - transmin_ts_us) - (srv_transmit_ts_us - srv_receive_ts_us)
-            # Adjust server time (T4) by half of the network delay
-            adjusted_server_time_us = srv_transmit_ts_us - (network_delay_us // 2)
-            # Adjust server time (T4) by the epoch difference
-            adjusted_server_time_us += cls.epoch_delta(from_epoch = cls.EPOCH_1900, to_epoch = epoch) * 1_000_000
-
-            # Return the adjusted server time and the reception time in us
-            return adjusted_server_time_us, receive_ts_us
+        # Wait for the first valid response within the timeout. On an unexpected error, like an invalid epoch,
+        # do not keep the socket for the next calls, because its state is unknown
+        try:
+            poller = _poll()
+            poller.register(s, _POLLIN)
+            start_ms = _ticks_ms()
+            while waiting:
+                remaining_ms = timeout_ms - _ticks_diff(_ticks_ms(), start_ms)
+                if remaining_ms <= 0 or not poller.poll(remaining_ms):
+                    break
+
+                # An error, like an ICMP port unreachable from one of the hosts, does not affect the responses of the others
+                try:
+                    length = s.readinto(msg)
+                except Exception as e:
+                    log('(NTP) Network error: Error({})', e)
+                    continue
+                receive_ts_us = _ticks_us()  # Record receive time (T2)
+
+                # The poll can report the socket as ready without a datagram to read, then readinto() returns None
+                if not length:
+                    continue
+
+                # UDP does not split datagrams, so a response shorter than an NTP header is malformed.
+                # A longer one, carrying extension fields, is truncated to the header by readinto().
+                # The sender of a response is known from its originate timestamp, so one which ends before it can not be charged
+                if length < 32:
+                    log('(NTP) Invalid packet length({})', length)
+                    continue
+
+                # Skip the responses to a previous call and the responses which do not match a waiting request
+                response_sequence, index = _unpack_from('!II', msg, 24)
+                if response_sequence != sequence or index >= len(hosts) or transmit_ts_us[index] is None:
+                    continue
+
+                host = hosts[index]
+                if length < 48:
+                    log('(NTP) Invalid packet length({}): Host({})', length, host)
+                    ntp_us = None
+                else:
+                    ntp_us = cls._ntp_response_us(msg, host, transmit_ts_us[index], receive_ts_us, epoch)
+                transmit_ts_us[index] = None
+                waiting -= 1
+                if ntp_us is None:
+                    cls._host_failed(host)
+                    continue
+
+                cls._host_succeeded(host)
+
+                # Return the adjusted server time and the reception time in us
+                return ntp_us, receive_ts_us
+        except Exception:
+            cls._ntp_socket = None
+            s.close()
+            raise
+
+        for index, host in enumerate(hosts):
+            if transmit_ts_us[index] is not None:
+                cls._host_addr_drop(host)
+                cls._host_failed(host)
+                log('(NTP) Network error: Host({}) Error({})', host, 'timeout')
+
+        # Nothing valid was received. Open a new socket on the next call, in case this one is broken
+        cls._ntp_socket = None
+        s.close()
 
         raise RuntimeError('Can not connect to any of the NTP servers')
 
@@ -708,12 +863,9 @@ class Ntp:
             raise ValueError('Invalid parameter: new_time={} must be a either None or 2-tuple(time, timestamp)'.format(new_time))
 
         # Take into account the time from the moment it was taken up to this point
-        ntp_us = new_time[0] + (time.ticks_us() - new_time[1])
-        lt = time.gmtime(ntp_us // 1000_000)
-        # lt = (year, month, day, hour, minute, second, weekday, yearday)
-        # index  0      1     2    3      4       5       6         7
+        ntp_us = new_time[0] + (_ticks_us() - new_time[1])
 
-        cls._datetime((lt[0], lt[1], lt[2], lt[6], lt[3], lt[4], lt[5], ntp_us % 1000_000))
+        cls._datetime(cls._secs_to_dt_tuple(ntp_us))
         cls._rtc_last_sync = ntp_us
 
     @classmethod
@@ -729,9 +881,13 @@ class Ntp:
             int: RTC last sync time in micro seconds by taking into account epoch and utc
         """
 
-        timezone_and_dst = 0 if utc else (cls._timezone + cls.dst())
-        epoch_delta = cls.epoch_delta(cls.device_epoch(), epoch)
-        return 0 if cls._rtc_last_sync == 0 else cls._rtc_last_sync + (epoch_delta + timezone_and_dst) * 1000_000
+        rtc_last_sync = cls._rtc_last_sync
+
+        # The RTC has never been synchronized. Skip the DST calculation
+        if rtc_last_sync == 0:
+            return 0
+
+        return rtc_last_sync + cls._offset_us(epoch, utc)
 
     @classmethod
     def drift_calculate(cls, new_time = None):
@@ -750,6 +906,8 @@ class Ntp:
         drift_compensate() to keep the RTC accurate. To calculate the drift in absolute
         micro seconds call drift_us(). Example: drift_compensate(drift_us()).
         The calculated drift is stored and can be retrieved later with drift_ppm().
+        If a tolerance is set with set_drift_tolerance(), the stored drift is the mean of the
+        last calculations and is updated only when there are at least two of them and they are consistent.
 
         Args:
             new_time (tuple): None or 2-tuple(time, timestamp). If None, the RTC will be synchronized
@@ -769,8 +927,11 @@ class Ntp:
                 while negative values represent RTC that is lagging
         """
 
+        rtc_last_sync = cls._rtc_last_sync
+        drift_last_compensate = cls._drift_last_compensate
+
         # The RTC has not been synchronized, and the actual drift can not be calculated
-        if cls._rtc_last_sync == 0 and cls._drift_last_compensate == 0:
+        if rtc_last_sync == 0 and drift_last_compensate == 0:
             return 0.0, 0
 
         if new_time is None:
@@ -778,16 +939,33 @@ class Ntp:
         elif not isinstance(new_time, tuple) or not len(new_time) == 2:
             raise ValueError('Invalid parameter: new_time={} must be a either None or 2-tuple(time, timestamp)'.format(new_time))
 
-        rtc_us = cls.time_us(epoch = cls.device_epoch(), utc = True)
+        rtc_us = cls._rtc_us()
         # For maximum precision, negate the execution time of all the instructions up to this point
-        ntp_us = new_time[0] + (time.ticks_us() - new_time[1])
+        ntp_us = new_time[0] + (_ticks_us() - new_time[1])
         # Calculate the delta between the current time and the last rtc sync or last compensate(whatever occurred last)
-        rtc_sync_delta = ntp_us - max(cls._rtc_last_sync, cls._drift_last_compensate)
+        rtc_sync_delta = ntp_us - (rtc_last_sync if rtc_last_sync > drift_last_compensate else drift_last_compensate)
         rtc_ntp_delta = rtc_us - ntp_us
-        cls._ppm_drift = (rtc_ntp_delta / rtc_sync_delta) * 1000_000
+        ppm_drift = (rtc_ntp_delta / rtc_sync_delta) * 1000_000
         cls._drift_last_calculate = ntp_us
 
-        return cls._ppm_drift, rtc_ntp_delta
+        tolerance = cls._drift_tolerance_ppm
+        if tolerance is None:
+            cls._ppm_drift = ppm_drift
+            cls._ppm_scale = None
+        else:
+            # A single sample is skewed by the network delay of its NTP query. Average the last samples and
+            # keep the previous drift while they are too few or too scattered to be trusted
+            samples = cls._drift_samples[1 - _DRIFT_SAMPLES:] + [ppm_drift]
+            cls._drift_samples = samples
+
+            mean = sum(samples) / len(samples)
+            variance = sum([(sample - mean) ** 2 for sample in samples]) / len(samples)
+            # The variance of a single sample is always 0, so it can not tell a noisy sample from an accurate one
+            if len(samples) >= 2 and variance <= tolerance * tolerance:
+                cls._ppm_drift = mean
+                cls._ppm_scale = None
+
+        return ppm_drift, rtc_ntp_delta
 
     @classmethod
     def drift_last_compensate(cls, epoch: int = None, utc: bool = False):
@@ -802,9 +980,13 @@ class Ntp:
             int: RTC last compensate time in micro seconds by taking into account epoch and utc
         """
 
-        timezone_and_dst = 0 if utc else (cls._timezone + cls.dst())
-        epoch_delta = cls.epoch_delta(cls.device_epoch(), epoch)
-        return 0 if cls._drift_last_compensate == 0 else cls._drift_last_compensate + (epoch_delta + timezone_and_dst) * 1000_000
+        drift_last_compensate = cls._drift_last_compensate
+
+        # The RTC has never been compensated. Skip the DST calculation
+        if drift_last_compensate == 0:
+            return 0
+
+        return drift_last_compensate + cls._offset_us(epoch, utc)
 
     @classmethod
     def drift_last_calculate(cls, epoch: int = None, utc: bool = False):
@@ -819,9 +1001,13 @@ class Ntp:
             int: the last drift calculation time in micro seconds by taking into account epoch and utc
         """
 
-        timezone_and_dst = 0 if utc else (cls._timezone + cls.dst())
-        epoch_delta = cls.epoch_delta(cls.device_epoch(), epoch)
-        return 0 if cls._drift_last_calculate == 0 else cls._drift_last_calculate + (epoch_delta + timezone_and_dst) * 1000_000
+        drift_last_calculate = cls._drift_last_calculate
+
+        # The drift has never been calculated. Skip the DST calculation
+        if drift_last_calculate == 0:
+            return 0
+
+        return drift_last_calculate + cls._offset_us(epoch, utc)
 
     @classmethod
     def drift_ppm(cls):
@@ -849,6 +1035,36 @@ class Ntp:
             raise ValueError('Invalid parameter: ppm={} must be float or int'.format(ppm))
 
         cls._ppm_drift = float(ppm)
+        cls._ppm_scale = None
+        cls._drift_samples = []
+
+    @classmethod
+    def set_drift_tolerance(cls, ppm: float = None):
+        """ Set the tolerance of the drift calculation. The network delay of every NTP query adds an error
+        to the calculated drift. When a tolerance is set, drift_calculate() averages the last few calculations
+        and updates the drift only if there are at least two of them and their standard deviation is within
+        the tolerance. Otherwise, the previous drift is kept.
+
+        Args:
+            ppm (float, int, None): max standard deviation of the calculations in ppm units.
+                If None, every calculation updates the drift as it is. Default is None
+        """
+
+        if ppm is not None and (not isinstance(ppm, (float, int)) or ppm < 0):
+            raise ValueError('Invalid parameter: ppm={} must be None or a positive float or int'.format(ppm))
+
+        cls._drift_tolerance_ppm = ppm
+        cls._drift_samples = []
+
+    @classmethod
+    def get_drift_tolerance(cls):
+        """ Get the tolerance of the drift calculation.
+
+        Returns:
+            float, int, None: max standard deviation of the drift calculations in ppm units. None if not set
+        """
+
+        return cls._drift_tolerance_ppm
 
     @classmethod
     def drift_us(cls, ppm_drift: float = None):
@@ -864,19 +1080,25 @@ class Ntp:
                 Positive values represent a speeding, while negative values represent a lagging RTC
         """
 
-        if cls._rtc_last_sync == 0 and cls._drift_last_compensate == 0:
+        rtc_last_sync = cls._rtc_last_sync
+        drift_last_compensate = cls._drift_last_compensate
+
+        if rtc_last_sync == 0 and drift_last_compensate == 0:
             return 0
 
         if ppm_drift is None:
-            ppm_drift = cls._ppm_drift
-
-        if not isinstance(ppm_drift, (float, int)):
+            ppm_scale = cls._ppm_scale
+            if ppm_scale is None:
+                ppm_scale = cls._ppm_scale = cls._ppm_drift / (1000_000 + cls._ppm_drift)
+        elif not isinstance(ppm_drift, (float, int)):
             raise ValueError('Invalid parameter: ppm_drift={} must be float or int'.format(ppm_drift))
+        else:
+            ppm_scale = ppm_drift / (1000_000 + ppm_drift)
 
-        delta_time_rtc = cls.time_us(epoch = cls.device_epoch(), utc = True) - max(cls._rtc_last_sync, cls._drift_last_compensate)
-        delta_time_real = int((1000_000 * delta_time_rtc) // (1000_000 + ppm_drift))
+        delta_time_rtc = cls._rtc_us() - (rtc_last_sync if rtc_last_sync > drift_last_compensate else drift_last_compensate)
 
-        return delta_time_rtc - delta_time_real
+        # The part of the elapsed RTC time caused by the drift is: delta_time_rtc * ppm / (1000_000 + ppm)
+        return int(delta_time_rtc * ppm_scale)
 
     @classmethod
     def drift_compensate(cls, compensate_us: int):
@@ -890,17 +1112,14 @@ class Ntp:
         if not isinstance(compensate_us, int):
             raise ValueError('Invalid parameter: compensate_us={} must be int'.format(compensate_us))
 
-        rtc_us = cls.time_us(epoch = cls.device_epoch(), utc = True) + compensate_us
-        lt = time.gmtime(rtc_us // 1000_000)
-        # lt = (year, month, day, hour, minute, second, weekday, yearday)
-        # index  0      1     2    3      4       5       6         7
+        rtc_us = cls._rtc_us() + compensate_us
 
-        cls._datetime((lt[0], lt[1], lt[2], lt[6], lt[3], lt[4], lt[5], rtc_us % 1000_000))
+        cls._datetime(cls._secs_to_dt_tuple(rtc_us))
         cls._drift_last_compensate = rtc_us
 
     @classmethod
     def weekday(cls, year: int, month: int, day: int):
-        """ Find Weekday using Zeller's Algorithm, from the year, month and day.
+        """ Find Weekday using Sakamoto's method, from the year, month and day.
 
         Args:
             year (int): number greater than 1
@@ -911,24 +1130,13 @@ class Ntp:
             int: 0(Mon) 1(Tue) 2(Wed) 3(Thu) 4(Fri) 5(Sat) to 6(Sun)
         """
 
-        if not isinstance(year, int) or not 1 <= year:
-            raise ValueError('Invalid parameter: year={} must be int and greater than 1'.format(year))
-        elif not isinstance(month, int) or not cls.MONTH_JAN <= month <= cls.MONTH_DEC:
-            raise ValueError('Invalid parameter: month={} must be int in range 1-12'.format(month))
+        cls._validate_year_month(year, month)
 
-        days = cls.days_in_month(year, month)
+        days = _days_in_month(year, month)
         if day > days:
             raise ValueError('Invalid parameter: day={} is greater than the days in month({})'.format(day, days))
 
-        if month <= 2:
-            month += 12
-            year -= 1
-
-        y = year % 100
-        c = year // 100
-        w = int(day + int((13 * (month + 1)) / 5) + y + int(y / 4) + int(c / 4) + 5 * c) % 7
-
-        return cls.__weekdays[w]
+        return _weekday(year, month, day)
 
     @classmethod
     def days_in_month(cls, year, month):
@@ -942,16 +1150,9 @@ class Ntp:
             int: the number of days in the given month
         """
 
-        if not isinstance(year, int) or not 1 <= year:
-            raise ValueError('Invalid parameter: year={} must be int and greater than 1'.format(year))
-        elif not isinstance(month, int) or not cls.MONTH_JAN <= month <= cls.MONTH_DEC:
-            raise ValueError('Invalid parameter: month={} must be int in range 1-12'.format(month))
+        cls._validate_year_month(year, month)
 
-        if month == cls.MONTH_FEB:
-            if (year % 400 == 0) or ((year % 4 == 0) and (year % 100 != 0)):
-                return cls.__days[1] + 1
-
-        return cls.__days[month - 1]
+        return _days_in_month(year, month)
 
     @classmethod
     def weeks_in_month(cls, year, month):
@@ -973,23 +1174,9 @@ class Ntp:
                 Example result for May 2021: [(1, 2), (3, 9), (10, 16), (17, 23), (24, 30), (31, 31)]
         """
 
-        if not isinstance(year, int) or not 1 <= year:
-            raise ValueError('Invalid parameter: year={} must be int and greater than 1'.format(year))
-        elif not isinstance(month, int) or not cls.MONTH_JAN <= month <= cls.MONTH_DEC:
-            raise ValueError('Invalid parameter: month={} must be int in range 1-12'.format(month))
-
-        first_sunday = 7 - cls.weekday(year, month, 1)
-        weeks_list = list()
-        weeks_list.append((1, first_sunday))
-        days_in_month = cls.days_in_month(year, month)
-        for i in range(0, 5):
-            if days_in_month <= first_sunday + (i + 1) * 7:
-                weeks_list.append((weeks_list[i][1] + 1, days_in_month))
-                break
-            else:
-                weeks_list.append((weeks_list[i][1] + 1, first_sunday + (i + 1) * 7))
+        cls._validate_year_month(year, month)
 
-        return weeks_list
+        return cls._weeks_in_month_unchecked(year, month)
 
     @classmethod
     def weekday_in_month(cls, year: int, month: int, ordinal_weekday: int, weekday: int):
@@ -1016,19 +1203,14 @@ class Ntp:
             ValueError: If any of the parameters are of incorrect type or out of the valid range.
         """
 
-        if not isinstance(year, int) or not 1 <= year:
-            raise ValueError('Invalid parameter: year={} must be int and greater than 1'.format(year))
-        elif not isinstance(month, int) or not cls.MONTH_JAN <= month <= cls.MONTH_DEC:
-            raise ValueError('Invalid parameter: month={} must be int in range 1-12'.format(month))
-        elif not isinstance(ordinal_weekday, int) or not cls.WEEK_FIRST <= ordinal_weekday <= cls.WEEK_LAST:
+        cls._validate_year_month(year, month)
+
+        if not isinstance(ordinal_weekday, int) or not cls.WEEK_FIRST <= ordinal_weekday <= cls.WEEK_LAST:
             raise ValueError('Invalid parameter: ordinal_weekday={} must be int in range 1-6'.format(ordinal_weekday))
         elif not isinstance(weekday, int) or not cls.WEEKDAY_MON <= weekday <= cls.WEEKDAY_SUN:
             raise ValueError('Invalid parameter: weekday={} must be int in range 0-6'.format(weekday))
 
-        first_weekday = cls.weekday(year, month, 1)  # weekday of first day of month
-        first_day = 1 + (weekday - first_weekday) % 7  # monthday of first requested weekday
-        weekdays = [i for i in range(first_day, cls.days_in_month(year, month) + 1, 7)]
-        return weekdays[-1] if ordinal_weekday > len(weekdays) else weekdays[ordinal_weekday - 1]
+        return cls._weekday_in_month_unchecked(year, month, ordinal_weekday, weekday)
 
     @classmethod
     def day_from_week_and_weekday(cls, year, month, week, weekday):
@@ -1053,38 +1235,44 @@ class Ntp:
                 given week, raise an exception
         """
 
-        if not isinstance(year, int) or not 1 <= year:
-            raise ValueError('Invalid parameter: year={} must be int and greater than 1'.format(year))
-        elif not isinstance(month, int) or not cls.MONTH_JAN <= month <= cls.MONTH_DEC:
-            raise ValueError('Invalid parameter: month={} must be int in range 1-12'.format(month))
-        elif not isinstance(week, int) or not cls.WEEK_FIRST <= week <= cls.WEEK_LAST:
+        cls._validate_year_month(year, month)
+
+        if not isinstance(week, int) or not cls.WEEK_FIRST <= week <= cls.WEEK_LAST:
             raise ValueError('Invalid parameter: week={} must be int in range 1-6'.format(week))
         elif not isinstance(weekday, int) or not cls.WEEKDAY_MON <= weekday <= cls.WEEKDAY_SUN:
             raise ValueError('Invalid parameter: weekday={} must be int in range 0-6'.format(weekday))
 
-        weeks = cls.weeks_in_month(year, month)
-        # Last day of the last week is the total days in month. This is faster instead of calling days_in_month(year, month)
-        days_in_month = weeks[-1][1]
+        # The weeks are computed arithmetically instead of building the list of weeks_in_month().
+        # The first week ends on the first Sunday and every next week starts on a Monday
+        first_sunday = 7 - _weekday(year, month, 1)
+        days_in_month = _days_in_month(year, month)
+        last_week = 1 + (days_in_month - first_sunday + 6) // 7
 
-        week_tuple = weeks[-1] if week > len(weeks) else weeks[week - 1]
-        day = week_tuple[0] + weekday
+        if week == cls.WEEK_FIRST:
+            week_start = 1
+            week_end = first_sunday
+        else:
+            week_start = first_sunday + 1 + 7 * ((last_week if week > last_week else week) - 2)
+            week_end = min(week_start + 6, days_in_month)
+
+        day = week_start + weekday
 
         # If the day is outside the boundaries of the month, select the week before the last
         # This behaviour guarantees to return the last weekday of the month
         if day > days_in_month:
-            return weeks[-2][0] + weekday
+            return first_sunday + 1 + 7 * (last_week - 3) + weekday
 
         # The desired weekday overflow the last day of the week
-        if day > week_tuple[1]:
+        if day > week_end:
             raise Exception('The weekday does not exists in the selected week')
 
         # The first week is an edge case thus it must be handled in a special way
         if week == cls.WEEK_FIRST:
             # If first week does not contain the week day return the weekday from the second week
-            if weeks[0][0] + (6 - weekday) > weeks[0][1]:
-                return weeks[1][0] + weekday
+            if 1 + (6 - weekday) > first_sunday:
+                return first_sunday + 1 + weekday
 
-            return weekday - (6 - weeks[0][1])
+            return weekday - (6 - first_sunday)
 
         return day
 
@@ -1114,7 +1302,115 @@ class Ntp:
         elif not isinstance(to_epoch, int) or not (cls.EPOCH_1900 <= to_epoch <= cls.EPOCH_2000):
             raise ValueError('Invalid parameter: to_epoch={} must be a one of Ntp.EPOCH_1900, Ntp.EPOCH_1970, Ntp.EPOCH_2000, None'.format(to_epoch))
 
-        return cls.__epoch_delta_lut[from_epoch][to_epoch]
+        return cls.__epoch_delta_lut[from_epoch * 3 + to_epoch]
+
+    @classmethod
+    def _device_epoch_delta(cls, epoch: int = None):
+        """ Same as epoch_delta(device_epoch(), epoch), but the result is cached. The delta for the user selected epoch
+        and the delta for the last explicitly requested epoch are kept separately.
+
+        Args:
+            epoch (int, None): an epoch according to which the time will be calculated. If None, the user selected epoch will be used.
+                Possible values: Ntp.EPOCH_1900, Ntp.EPOCH_1970, Ntp.EPOCH_2000, None
+
+        Returns:
+            int: The delta between the device's epoch and the given epoch in seconds
+        """
+
+        if epoch is None:
+            delta = cls._cached_default_epoch_delta
+            if delta is None:
+                delta = cls._cached_default_epoch_delta = cls.__epoch_delta_lut[cls.device_epoch() * 3 + cls._epoch]
+            return delta
+
+        # Compare by identity, so that only an epoch which already passed validation can hit the cache (1.0 == 1, but 1.0 is not 1)
+        if epoch is cls._epoch_delta_cache_key:
+            return cls._epoch_delta_cache_val
+
+        delta = cls.epoch_delta(cls.device_epoch(), epoch)
+        cls._epoch_delta_cache_key = epoch
+        cls._epoch_delta_cache_val = delta
+        return delta
+
+    @classmethod
+    def _time_parts(cls, epoch: int = None, utc: bool = False):
+        """ Read the current time split into whole seconds and a subsecond part. Used by time_s(), time_ms()
+        and time_us(), so that each of them scales only what it needs.
+
+        Args:
+            epoch (int, None): an epoch according to which the time will be calculated. If None, the user selected epoch will be used.
+                Possible values: Ntp.EPOCH_1900, Ntp.EPOCH_1970, Ntp.EPOCH_2000, None
+            utc (bool): the returned time will be according to UTC time
+
+        Returns:
+            tuple: 2-tuple(seconds, subsecond). The seconds since the selected epoch and the microseconds since the last whole second
+        """
+
+        # dt = (year, month, day, weekday, hour, minute, second, subsecond)
+        # index  0      1     2      3       4      5       6        7
+        dt = cls._datetime()
+
+        # Unpack in one step instead of indexing the tuple for every field
+        year, month, day, _, hour, minute, second, subsecond = dt
+        # mktime() uses the device's epoch
+        seconds = cls._midnight_secs(year, month, day) + hour * 3600 + minute * 60 + second + cls._device_epoch_delta(epoch)
+
+        # Daylight Saving Time (DST) is not used for UTC as it is a time standard for all time zones.
+        if not utc:
+            seconds += cls._timezone + cls._dst(dt)
+
+        return seconds, subsecond
+
+    @classmethod
+    def _midnight_secs(cls, year: int, month: int, day: int):
+        """ Get the seconds since the device's epoch at midnight of the given date. The result is cached,
+        so mktime() runs only once per day instead of on every RTC read.
+
+        Args:
+            year (int): number greater than 1
+            month (int): number in range 1(Jan) - 12(Dec)
+            day (int): number in range 1-31
+
+        Returns:
+            int: the seconds since the device's epoch
+        """
+
+        if day != cls._midnight_cache_day or month != cls._midnight_cache_month or year != cls._midnight_cache_year:
+            cls._midnight_cache_secs = _mktime((year, month, day, 0, 0, 0, 0, 0, 0))
+            cls._midnight_cache_year = year
+            cls._midnight_cache_month = month
+            cls._midnight_cache_day = day
+
+        return cls._midnight_cache_secs
+
+    @classmethod
+    def _rtc_us(cls):
+        """ Same as time_us(device_epoch(), True), but reads the RTC directly, without going through
+        the epoch, timezone and DST logic.
+
+        Returns:
+            int: the RTC time in micro seconds in UTC since the device's epoch
+        """
+
+        year, month, day, _, hour, minute, second, subsecond = cls._datetime()
+        return (cls._midnight_secs(year, month, day) + hour * 3600 + minute * 60 + second) * _US_PER_S + subsecond
+
+    @classmethod
+    def _offset_us(cls, epoch: int = None, utc: bool = False):
+        """ Get the offset to add to a UTC time in micro seconds since the device's epoch, to get
+        the time according to the given epoch, timezone and Daylight Saving Time.
+
+        Args:
+            epoch (int, None): an epoch according to which the time will be calculated. If None, the user selected epoch will be used.
+                Possible values: Ntp.EPOCH_1900, Ntp.EPOCH_1970, Ntp.EPOCH_2000, None
+            utc (bool): skip the timezone and DST
+
+        Returns:
+            int: the offset in micro seconds
+        """
+
+        timezone_and_dst = 0 if utc else (cls._timezone + cls.dst())
+        return (cls._device_epoch_delta(epoch) + timezone_and_dst) * _US_PER_S
 
     @classmethod
     def device_epoch(cls):
@@ -1124,34 +1420,26 @@ class Ntp:
         Returns:
             int: Ntp.EPOCH_1900, Ntp.EPOCH_1970, Ntp.EPOCH_2000
         """
-        # Return the cached value
-        if cls._device_epoch is not None:
-            return cls._device_epoch
 
-        # Get the device epoch
-        year = time.gmtime(0)[0]
-        if year == 1900:
-            cls._device_epoch = cls.EPOCH_1900
-            return cls._device_epoch
-        elif year == 1970:
-            cls._device_epoch = cls.EPOCH_1970
-            return cls._device_epoch
-        elif year == 2000:
-            cls._device_epoch = cls.EPOCH_2000
-            return cls._device_epoch
+        # The epoch is probed at import
+        device_epoch = cls._device_epoch
+        if device_epoch is None:
+            raise RuntimeError('Unsupported device epoch({})'.format(_gmtime(0)[0]))
 
-        raise RuntimeError('Unsupported device epoch({})'.format(year))
+        return device_epoch
 
     @classmethod
-    def _log(cls, message: str):
-        """ Use the logger callback to log a message.
+    def _log(cls, message: str, *args):
+        """ Use the logger callback to log a message. The message is formatted only when
+        there is a logger callback, so no strings are built while logging is disabled.
 
         Args:
             message (str): the message to be passed to the logger
+            args: optional arguments to format the message with
         """
 
         if callable(cls._log_callback):
-            cls._log_callback(message)
+            cls._log_callback(message.format(*args) if args else message)
 
     @classmethod
     def _datetime(cls, *dt):
@@ -1167,11 +1455,288 @@ class Ntp:
             raise Exception('No callback set to access the RTC')
 
         try:
-            return cls._datetime_callback(*dt)
+            return cls._datetime_setter(*dt) if dt else cls._datetime_getter()
         except Exception as e:
-            cls._log('(RTC) Error. {}'.format(e))
+            cls._log('(RTC) Error. {}', e)
             raise e
 
+    @classmethod
+    def _resolve(cls, host: str):
+        """ Resolve the socket address of a host. The address is cached and reused until it expires,
+        so most of the requests skip the DNS query.
+
+        Args:
+            host (str): hostname or IP address in dot notation
+
+        Returns:
+            tuple: the socket address of the host
+        """
+
+        addr_cache = cls._host_addr_cache
+        entry = addr_cache.get(host)
+        now_ms = _ticks_ms()
+        # A remaining time longer than the TTL means that the tick counter has wrapped around since the address was cached
+        if entry is not None and 0 < _ticks_diff(entry[1], now_ms) <= _HOST_ADDR_TTL_MS:
+            return entry[0]
+
+        host_addr = _getaddrinfo(host, 123)[0][-1]
+        addr_cache = dict(addr_cache)
+        addr_cache[host] = (host_addr, _ticks_add(now_ms, _HOST_ADDR_TTL_MS))
+        cls._host_addr_cache = addr_cache
+        return host_addr
+
+    @classmethod
+    def _host_addr_drop(cls, host: str):
+        """ Remove the cached address of a host, so it is resolved again on the next request.
+
+        Args:
+            host (str): hostname or IP address in dot notation
+        """
+
+        addr_cache = cls._host_addr_cache
+        if host in addr_cache:
+            addr_cache = dict(addr_cache)
+            del addr_cache[host]
+            cls._host_addr_cache = addr_cache
+
+    @classmethod
+    def _host_failed(cls, host: str):
+        """ Skip a failing host for a while. The time doubles on every consecutive failure, up to _HOST_BACKOFF_MAX_S.
+
+        Args:
+            host (str): the failing host
+        """
+
+        backoff = dict(cls._host_backoff)
+        failures = backoff.get(host, (0, 0))[0] + 1
+        backoff_s = min(1 << min(failures, 12), _HOST_BACKOFF_MAX_S)
+        backoff[host] = (failures, _ticks_add(_ticks_ms(), backoff_s * 1000))
+        cls._host_backoff = backoff
+
+    @classmethod
+    def _host_succeeded(cls, host: str):
+        """ Reset the backoff of a host after a valid response.
+
+        Args:
+            host (str): the host which responded
+        """
+
+        backoff = cls._host_backoff
+        if host in backoff:
+            backoff = dict(backoff)
+            del backoff[host]
+            cls._host_backoff = backoff
+
+    @classmethod
+    def _host_backing_off(cls, host: str):
+        """ Check if a failing host must be skipped.
+
+        Args:
+            host (str): the host to check
+
+        Returns:
+            bool: True if the host must be skipped, False otherwise
+        """
+
+        entry = cls._host_backoff.get(host)
+        if entry is None:
+            return False
+
+        # A remaining time longer than the max backoff means that the tick counter has wrapped around since the failure
+        return 0 < _ticks_diff(entry[1], _ticks_ms()) <= _HOST_BACKOFF_MAX_S * 1000
+
+    @classmethod
+    def _ntp_response_us(cls, msg, host: str, transmit_ts_us: int, receive_ts_us: int, epoch: int = None):
+        """ Validate an NTP response and get the server time from it.
+
+        Args:
+            msg (bytearray): the NTP response packet
+            host (str): the host which sent the response. Used for logging
+            transmit_ts_us (int): the timestamp in microseconds at the moment the request was sent (T1)
+            receive_ts_us (int): the timestamp in microseconds at the moment the response was received (T2)
+            epoch (int, None): an epoch according to which the time will be calculated. If None, the user selected epoch will be used.
+
+        Returns:
+            int, None: the server time adjusted for the network delay in microseconds since the given epoch. None if the response is invalid
+        """
+
+        # The mode and the leap indicator share the first byte of the header
+        header = msg[0]
+
+        # Mode: The mode field of the NTP packet is an 8-bit field that specifies the mode of the packet.
+        # A value of 4 indicates a server response, so if the mode value is not 4, the packet is invalid.
+        if (header & _NTP_MODE_MASK) != _NTP_MODE_SERVER:
+            cls._log('(NTP) Invalid packet due to bad "mode" field value: Host({})', host)
+            return None
+
+        # Leap Indicator: The leap indicator field of the NTP packet is a 2-bit field that indicates the status of the server's clock.
+        # A value of 0 or 1 indicates a normal or unsynchronized clock, so if the leap indicator field is set to any other value, the packet is invalid.
+        if (header >> _NTP_LEAP_SHIFT) > 2:
+            cls._log('(NTP) Invalid packet due to bad "leap" field value: Host({})', host)
+            return None
+
+        # Stratum: The stratum field of the NTP packet is an 8-bit field that indicates the stratum level of the server.
+        # A value outside the range 1 to 15 indicates an invalid packet.
+        if not (1 <= (msg[1]) <= 15):
+            cls._log('(NTP) Invalid packet due to bad "stratum" field value: Host({})', host)
+            return None
+
+        # Extract T3 and T4 from the NTP packet. Both are adjacent, so they are unpacked with a single call
+        # Receive Timestamp (T3): The Receive Timestamp field of the NTP packet is a 64-bit field that contains the server's time when the packet was received.
+        # Transmit Timestamp (T4): The Transmit Timestamp field of the NTP packet is a 64-bit field that contains the server's time when the packet was sent.
+        srv_receive_ts_sec, srv_receive_ts_frac, srv_transmit_ts_sec, srv_transmit_ts_frac = _unpack_from('!IIII', msg, 32)  # T3, T4
+
+        # If any of these fields is zero, it may indicate that the packet is invalid.
+        if srv_transmit_ts_sec == 0 or srv_receive_ts_sec == 0:
+            cls._log('(NTP) Invalid packet: Host({})', host)
+            return None
+
+        # Convert T3 to microseconds
+        srv_receive_ts_us = srv_receive_ts_sec * _US_PER_S + (srv_receive_ts_frac * _NTP_FRAC_US_MUL >> _NTP_FRAC_US_SHIFT)
+        # Convert T4 to microseconds
+        srv_transmit_ts_us = srv_transmit_ts_sec * _US_PER_S + (srv_transmit_ts_frac * _NTP_FRAC_US_MUL >> _NTP_FRAC_US_SHIFT)
+        # Calculate network delay in microseconds
+        network_delay_us = _ticks_diff(receive_ts_us, transmit_ts_us) - (srv_transmit_ts_us - srv_receive_ts_us)
+        # Adjust server time (T4) by half of the network delay
+        adjusted_server_time_us = srv_transmit_ts_us - (network_delay_us // 2)
+        # Adjust server time (T4) by the epoch difference. Use the cached delta for the default epoch
+        if epoch is None:
+            adjusted_server_time_us += cls._epoch_delta_from_1900 * _US_PER_S
+        else:
+            adjusted_server_time_us += cls.epoch_delta(cls.EPOCH_1900, epoch) * _US_PER_S
+
+        return adjusted_server_time_us
+
+    @classmethod
+    def _validate_year_month(cls, year: int, month: int):
+        """ Validate the year and the month of the calendar functions. Raise ValueError if any of the parameters is invalid.
+
+        Args:
+            year (int): number greater than 1
+            month (int): number in range 1(Jan) - 12(Dec)
+        """
+
+        if not isinstance(year, int) or not 1 <= year:
+            raise ValueError('Invalid parameter: year={} must be int and greater than 1'.format(year))
+        elif not isinstance(month, int) or not cls.MONTH_JAN <= month <= cls.MONTH_DEC:
+            raise ValueError('Invalid parameter: month={} must be int in range 1-12'.format(month))
+
+    @classmethod
+    def _validate_dst_point(cls, month: int, week: int, weekday: int, hour: int):
+        """ Validate the start or the end point of the DST. Raise ValueError if any of the parameters is invalid.
+
+        Args:
+            month (int): number in (Ntp.MONTH_JAN ... Ntp.MONTH_DEC)
+            week (int): integer in (Ntp.WEEK_FIRST ... Ntp.WEEK_LAST)
+            weekday (int): integer in (Ntp.WEEKDAY_MON ... Ntp.WEEKDAY_SUN)
+            hour (int): integer in range 0 - 23
+        """
+
+        if not isinstance(month, int) or not cls.MONTH_JAN <= month <= cls.MONTH_DEC:
+            raise ValueError("Invalid parameter: month={} must be a integer in (Ntp.MONTH_JAN ... Ntp.MONTH_DEC)".format(month))
+        elif not isinstance(week, int) or not cls.WEEK_FIRST <= week <= cls.WEEK_LAST:
+            raise ValueError("Invalid parameter: week={} must be a integer in (Ntp.WEEK_FIRST ... Ntp.WEEK_LAST)".format(week))
+        elif not isinstance(weekday, int) or not cls.WEEKDAY_MON <= weekday <= cls.WEEKDAY_SUN:
+            raise ValueError("Invalid parameter: weekday={} must be a integer in (Ntp.WEEKDAY_MON ... Ntp.WEEKDAY_SUN)".format(weekday))
+        elif not isinstance(hour, int) or not 0 <= hour <= 23:
+            raise ValueError("Invalid parameter: hour={} must be a integer between 0 and 23".format(hour))
+
+    @classmethod
+    def _dst(cls, dt: tuple):
+        """ Same as dst(dt), but without validating the datetime tuple. Used on the hot path, where
+        the tuple comes straight from the RTC.
+
+        Args:
+            dt (tuple): 8-tuple(year, month, day, weekday, hour, minute, second, subsecond)
+
+        Returns:
+            int: Calculated DST bias in seconds
+        """
+
+        # Return 0 if DST is disabled
+        if not cls._dst_enabled:
+            return 0
+
+        year = dt[0]
+        month = dt[1]
+
+        # Calculates and caches the hours since the beginning of the year when the DST starts/ends
+        if year != cls._dst_cache_switch_hours_timestamp:
+            # February 29 is added to the days before every month after February
+            leap_day = _days_in_month(year, cls.MONTH_FEB) - 28
+            days_cum = cls.__days_cum
+            start_month, start_week, start_weekday, start_hour = cls._dst_start
+            end_month, end_week, end_weekday, end_hour = cls._dst_end
+            # The DST start and end are validated when they are set, so the validation can be skipped
+            start_day = cls._weekday_in_month_unchecked(year, start_month, start_week, start_weekday)
+            end_day = cls._weekday_in_month_unchecked(year, end_month, end_week, end_weekday)
+            cls._dst_cache_switch_hours_start = (days_cum[start_month - 1] + (start_month > 2 and leap_day) + start_day) * 24 + start_hour
+            cls._dst_cache_switch_hours_end = (days_cum[end_month - 1] + (end_month > 2 and leap_day) + end_day) * 24 + end_hour
+            cls._dst_cache_leap_day = leap_day
+            cls._dst_cache_switch_hours_timestamp = year
+
+        # The current hours since the beginning of the year, counted the same way as the cached switch hours
+        hours = (cls.__days_cum[month - 1] + (month > 2 and cls._dst_cache_leap_day) + dt[2]) * 24 + dt[4]
+        start = cls._dst_cache_switch_hours_start
+        end = cls._dst_cache_switch_hours_end
+
+        # Northern hemisphere: the DST period is inside the year.
+        # Southern hemisphere: the DST starts late in the year and ends early in the next one, so it is in effect outside [end, start)
+        if (start <= hours < end) if start <= end else not (end <= hours < start):
+            return cls._dst_bias
+
+        # The current time is outside the DST period
+        return 0
+
+    @classmethod
+    def _weeks_in_month_unchecked(cls, year: int, month: int):
+        """ Same as weeks_in_month(), but without validating the parameters. """
+
+        first_sunday = 7 - _weekday(year, month, 1)
+        days_in_month = _days_in_month(year, month)
+
+        # Every week after the first starts on a Monday and is cut at the end of the month
+        return [(1, first_sunday)] + [(monday, min(monday + 6, days_in_month)) for monday in range(first_sunday + 1, days_in_month + 1, 7)]
+
+    @classmethod
+    def _weekday_in_month_unchecked(cls, year: int, month: int, ordinal_weekday: int, weekday: int):
+        """ Same as weekday_in_month(), but without validating the parameters. """
+
+        first_weekday = _weekday(year, month, 1)  # weekday of first day of month
+        first_day = 1 + (weekday - first_weekday) % 7  # monthday of first requested weekday
+        day = first_day + 7 * (ordinal_weekday - 1)  # monthday of the requested occurrence
+        last_day = first_day + 7 * ((_days_in_month(year, month) - first_day) // 7)  # monthday of the last occurrence
+        return last_day if day > last_day else day
+
+    @classmethod
+    def _secs_to_dt_tuple(cls, us: int):
+        """ Convert a timestamp to the 8-tuple format used by the RTC in a single pass,
+        without going through time.gmtime() and rebuilding the result.
+
+        Args:
+            us (int): the micro second time in UTC since the device's epoch
+
+        Returns:
+            tuple: 8-tuple(year, month, day, weekday, hour, minute, second, subsecond)
+        """
+
+        secs, us = divmod(int(us), _US_PER_S)
+        days, secs = divmod(secs + cls.epoch_delta(cls.device_epoch(), cls.EPOCH_1970), 86400)
+        hour, secs = divmod(secs, 3600)
+        minute, second = divmod(secs, 60)
+
+        # Civil date from days since 1970-01-01. The year is shifted to start on the 1st of March,
+        # so the leap day is always the last day of the year
+        era, doe = divmod(days + 719468, 146097)  # 400-year era and day of era
+        yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365  # Year of era
+        doy = doe - (365 * yoe + yoe // 4 - yoe // 100)  # Day of year, starting from the 1st of March
+        mp = (5 * doy + 2) // 153  # Month, starting from March
+        month = mp + 3 if mp < 10 else mp - 9
+
+        # 1970-01-01 is a Thursday
+        return (yoe + era * 400 + (month <= 2), month, doy - (153 * mp + 2) // 5 + 1, (days + 3) % 7,
+                hour, minute, second, us)
+
     @staticmethod
     def _validate_host(host: str):
         """ Check if a host is valid. A host can be any valid hostname or IP address
@@ -1183,10 +1748,12 @@ class Ntp:
             bool: True on success, False on error
         """
 
-        if Ntp._validate_ip(host) or Ntp._validate_hostname(host):
-            return True
+        # An IP address consists only of digits and dots, so run just one of the validators.
+        # A hostname made only of digits and dots is never valid, because its TLD would be all-numeric
+        if isinstance(host, str) and host.strip('0123456789.'):
+            return Ntp._validate_hostname(host)
 
-        return False
+        return Ntp._validate_ip(host)
 
     @staticmethod
     def _validate_hostname(hostname: str):
@@ -1202,6 +1769,10 @@ class Ntp:
         if not isinstance(hostname, str):
             raise ValueError('Invalid parameter: hostname={} must be a string'.format(hostname))
 
+        # The $ of the regex also matches before a trailing newline, so reject the surrounding whitespace first
+        if hostname != hostname.strip():
+            return False
+
         # strip exactly one dot from the right, if present
         if hostname[-1] == '.':
             hostname = hostname[:-1]
@@ -1212,11 +1783,16 @@ class Ntp:
         labels = hostname.split('.')
 
         # the TLD must be not all-numeric
-        if re.match(r'[0-9]+$', labels[-1]):
+        if labels[-1].isdigit():
             return False
 
-        allowed = re.compile(r'^(([a-zA-Z0-9]|[a-zA-Z0-9][a-zA-Z0-9_\-]*[a-zA-Z0-9])\.)*([A-Za-z0-9]|[A-Za-z0-9][A-Za-z0-9_\-]*[A-Za-z0-9])$')
-        if not allowed.match(hostname):
+        # Cheap checks first, to reject most malformed hostnames before running the regex.
+        # A label is 1 to 63 characters long and can not start or end with a hyphen or an underscore
+        for label in labels:
+            if not 0 < len(label) <= 63 or label[0] in '-_' or label[-1] in '-_':
+                return False
+
+        if not _HOSTNAME_RE.match(hostname):
             return False
 
         return True
@@ -1235,9 +1811,13 @@ class Ntp:
         if not isinstance(ip, str):
             raise ValueError('Invalid parameter: ip={} must be a string'.format(ip))
 
-        allowed = re.compile(
-            r'^(25[0-5]|2[0-4][0-9]|[0-1]?[0-9][0-9]?)\.(25[0-5]|2[0-4][0-9]|[0-1]?[0-9][0-9]?)\.(25[0-5]|2[0-4][0-9]|[0-1]?[0-9][0-9]?)\.(25[0-5]|2[0-4][0-9]|[0-1]?[0-9][0-9]?)$')
-        if allowed.match(ip) is None:
+        parts = ip.split('.')
+        if len(parts) != 4:
             return False
 
+        for part in parts:
+            # Each part must be 1 to 3 decimal digits with a value up to 255. Leading zeros are allowed
+            if not 0 < len(part) <= 3 or part.strip('0123456789') or int(part) > 255:
+                return False
+
         return True
@@ -1,3 +1,6 @@
+import calendar
+import struct
+import time
 import unittest
 from ..src import ntp
 
@@ -66,5 +69,564 @@ class TestDayFromWeekAndWeekday(unittest.TestCase):
             ntp.Ntp.day_from_week_and_weekday(2022, 1, 1, 8)
 
 
+class TestSecsToDtTuple(unittest.TestCase):
+    """Unit tests for function _secs_to_dt_tuple(cls, us), compared with time.gmtime()"""
+
+    def assertSameAsGmtime(self, us):
+        secs, subsecond = divmod(us, 1000_000)
+        t = time.gmtime(secs)
+        self.assertEqual(ntp.Ntp._secs_to_dt_tuple(us), (t[0], t[1], t[2], t[6], t[3], t[4], t[5], subsecond), us)
+
+    def test_dates(self):
+        dates = [
+            (1900, 1, 1, 0, 0, 0), (1900, 2, 28, 23, 59, 59), (1900, 3, 1, 0, 0, 0),  # 1900 is not a leap year
+            (1969, 12, 31, 23, 59, 59), (1970, 1, 1, 0, 0, 0),
+            (1999, 12, 31, 23, 59, 59), (2000, 1, 1, 0, 0, 0),
+            (2000, 2, 29, 12, 0, 0), (2000, 3, 1, 0, 0, 0),  # 2000 is a leap year
+            (2023, 2, 28, 23, 59, 59), (2023, 3, 1, 0, 0, 0), (2024, 2, 29, 23, 59, 59), (2024, 12, 31, 23, 59, 59),
+            (2036, 2, 7, 6, 28, 16), (2038, 1, 19, 3, 14, 8),
+            (2100, 2, 28, 23, 59, 59), (2100, 3, 1, 0, 0, 0),  # 2100 is not a leap year
+            (2400, 2, 29, 0, 0, 0), (2400, 12, 31, 23, 59, 59),
+        ]
+        for date in dates:
+            secs = calendar.timegm(date + (0, 0, 0))
+            for subsecond in (0, 1, 999_999):
+                self.assertSameAsGmtime(secs * 1000_000 + subsecond)
+
+    def test_range(self):
+        # Every 3 days and 1 hour from 1900 to 2224, with a varying time of the day and subsecond
+        start = calendar.timegm((1900, 1, 1, 0, 0, 0, 0, 0, 0))
+        end = calendar.timegm((2224, 1, 1, 0, 0, 0, 0, 0, 0))
+        for i, secs in enumerate(range(start, end, 3 * 86400 + 3600 + 7)):
+            self.assertSameAsGmtime(secs * 1000_000 + i * 7919 % 1000_000)
+
+
+class TestValidateHost(unittest.TestCase):
+    """Unit tests for function _validate_host(host)"""
+
+    def test_valid_hosts(self):
+        for host in ('pool.ntp.org', '0.pool.ntp.org', 'time.google.com.', 'localhost', '1.2.3.4', '255.255.255.255'):
+            self.assertTrue(ntp.Ntp._validate_host(host), host)
+
+    def test_invalid_hosts(self):
+        for host in ('', '.', '123', '1.2.3', '256.1.1.1', '1.2.3.4.5', 'a..b', '-a.com', 'x.123', 'a b.com'):
+            self.assertFalse(ntp.Ntp._validate_host(host), host)
+
+    def test_whitespace(self):
+        for host in ('0\n', '46118\n', '54.66\n', '1.2.3.4\n', 'a.com\n', ' a.com', 'a.com ', '\tpool.ntp.org', '\n'):
+            self.assertFalse(ntp.Ntp._validate_host(host), repr(host))
+
+
+class TestDst(unittest.TestCase):
+    """Unit tests for function dst(cls, dt)"""
+
+    def setUp(self):
+        # Work on a subclass, so the class state of ntp.Ntp is not changed by the tests
+        class Ntp(ntp.Ntp):
+            pass
+
+        self.ntp = Ntp
+
+    def assertDst(self, dst, *dates):
+        for date in dates:
+            year, month, day, hour = date
+            dt = (year, month, day, ntp.Ntp.weekday(year, month, day), hour, 30, 0, 0)
+            self.assertEqual(self.ntp.dst(dt), dst, date)
+
+    def test_northern(self):
+        # EU: from the last Sunday of March to the last Sunday of October. 2024-03-31 and 2024-10-27
+        self.ntp.set_dst((ntp.Ntp.MONTH_MAR, ntp.Ntp.WEEK_LAST, ntp.Ntp.WEEKDAY_SUN, 2),
+                         (ntp.Ntp.MONTH_OCT, ntp.Ntp.WEEK_LAST, ntp.Ntp.WEEKDAY_SUN, 3), 60)
+        self.assertDst(0, (2024, 1, 1, 0), (2024, 3, 30, 23), (2024, 3, 31, 1), (2024, 10, 27, 3), (2024, 12, 31, 23))
+        self.assertDst(3600, (2024, 3, 31, 2), (2024, 3, 31, 3), (2024, 7, 1, 12), (2024, 10, 27, 1), (2024, 10, 27, 2))
+
+    def test_southern(self):
+        # AU: from the first Sunday of October to the first Sunday of April of the next year. 2024-04-07 and 2024-10-06
+        self.ntp.set_dst((ntp.Ntp.MONTH_OCT, ntp.Ntp.WEEK_FIRST, ntp.Ntp.WEEKDAY_SUN, 2),
+                         (ntp.Ntp.MONTH_APR, ntp.Ntp.WEEK_FIRST, ntp.Ntp.WEEKDAY_SUN, 3), 60)
+        self.assertDst(3600, (2024, 1, 1, 0), (2024, 4, 7, 1), (2024, 4, 7, 2), (2024, 10, 6, 2), (2024, 10, 6, 3), (2024, 12, 31, 23))
+        self.assertDst(0, (2024, 4, 7, 3), (2024, 4, 7, 4), (2024, 7, 1, 12), (2024, 10, 6, 0), (2024, 10, 6, 1))
+
+    def test_leap_day(self):
+        # From the first Sunday of March. 2023-03-05 and 2024-03-03
+        self.ntp.set_dst((ntp.Ntp.MONTH_MAR, ntp.Ntp.WEEK_FIRST, ntp.Ntp.WEEKDAY_SUN, 2),
+                         (ntp.Ntp.MONTH_NOV, ntp.Ntp.WEEK_FIRST, ntp.Ntp.WEEKDAY_SUN, 2), 60)
+        self.assertDst(0, (2023, 2, 28, 23), (2023, 3, 1, 0), (2023, 3, 5, 1), (2024, 2, 29, 23), (2024, 3, 1, 0), (2024, 3, 3, 1))
+        self.assertDst(3600, (2023, 3, 5, 2), (2023, 3, 5, 3), (2024, 3, 3, 2), (2024, 3, 3, 3))
+
+        # Until the first Sunday of March. The leap day is inside the DST period
+        self.ntp.set_dst((ntp.Ntp.MONTH_OCT, ntp.Ntp.WEEK_FIRST, ntp.Ntp.WEEKDAY_SUN, 2),
+                         (ntp.Ntp.MONTH_MAR, ntp.Ntp.WEEK_FIRST, ntp.Ntp.WEEKDAY_SUN, 3), 60)
+        self.assertDst(3600, (2023, 2, 28, 23), (2023, 3, 5, 2), (2024, 2, 29, 0), (2024, 2, 29, 23), (2024, 3, 3, 2))
+        self.assertDst(0, (2023, 3, 5, 3), (2023, 3, 5, 4), (2024, 3, 3, 3), (2024, 3, 3, 4))
+
+    def test_same_month(self):
+        # From the first to the last Sunday of March. 2024-03-03 and 2024-03-31
+        self.ntp.set_dst((ntp.Ntp.MONTH_MAR, ntp.Ntp.WEEK_FIRST, ntp.Ntp.WEEKDAY_SUN, 2),
+                         (ntp.Ntp.MONTH_MAR, ntp.Ntp.WEEK_LAST, ntp.Ntp.WEEKDAY_SUN, 3), 60)
+        self.assertDst(0, (2024, 2, 29, 12), (2024, 3, 3, 1), (2024, 3, 31, 3), (2024, 3, 31, 4), (2024, 4, 1, 0))
+        self.assertDst(3600, (2024, 3, 3, 2), (2024, 3, 3, 3), (2024, 3, 15, 12), (2024, 3, 31, 1), (2024, 3, 31, 2))
+
+    def test_rule_change(self):
+        # The switch hours of the year are cached. Changing the rule must not reuse them
+        self.ntp.set_dst((ntp.Ntp.MONTH_MAR, ntp.Ntp.WEEK_LAST, ntp.Ntp.WEEKDAY_SUN, 2),
+                         (ntp.Ntp.MONTH_OCT, ntp.Ntp.WEEK_LAST, ntp.Ntp.WEEKDAY_SUN, 3), 60)
+        self.assertDst(0, (2024, 3, 30, 12))
+        self.assertDst(3600, (2024, 7, 1, 12))
+
+        self.ntp.set_dst_start(ntp.Ntp.MONTH_MAR, ntp.Ntp.WEEK_FIRST, ntp.Ntp.WEEKDAY_SUN, 2)
+        self.assertDst(3600, (2024, 3, 30, 12))
+
+        self.ntp.set_dst_end(ntp.Ntp.MONTH_MAR, ntp.Ntp.WEEK_LAST, ntp.Ntp.WEEKDAY_SUN, 3)
+        self.assertDst(0, (2024, 7, 1, 12))
+
+        self.ntp.set_dst((ntp.Ntp.MONTH_OCT, ntp.Ntp.WEEK_FIRST, ntp.Ntp.WEEKDAY_SUN, 2),
+                         (ntp.Ntp.MONTH_APR, ntp.Ntp.WEEK_FIRST, ntp.Ntp.WEEKDAY_SUN, 3), 30)
+        self.assertDst(1800, (2024, 1, 1, 0))
+
+        self.ntp.set_dst()
+        self.assertDst(0, (2024, 1, 1, 0))
+
+
+class TestDriftTolerance(unittest.TestCase):
+    """Unit tests for function drift_calculate(cls, new_time) with a tolerance set by set_drift_tolerance(cls, ppm)"""
+
+    def setUp(self):
+        # Freeze the CPU ticks, so the time passed to drift_calculate() is used as it is
+        self.ticks_us = ntp._ticks_us
+        ntp._ticks_us = lambda: 0
+
+        # Work on a subclass, so the class state of ntp.Ntp is not changed by the tests
+        class Ntp(ntp.Ntp):
+            _rtc_last_sync = 1000_000_000
+            rtc_us = 0
+
+            @classmethod
+            def _rtc_us(cls):
+                return cls.rtc_us
+
+        self.ntp = Ntp
+
+    def tearDown(self):
+        ntp._ticks_us = self.ticks_us
+
+    def calculate(self, ppm, cls=None):
+        # The RTC was synchronized 1000 sec ago, so a drift of 1 ppm makes it 1000 us ahead
+        cls = cls or self.ntp
+        ntp_us = 2000_000_000
+        cls.rtc_us = ntp_us + round(ppm * 1000)
+        return cls.drift_calculate((ntp_us, 0))[0]
+
+    def test_single_sample(self):
+        self.ntp.set_drift_tolerance(1)
+        self.ntp.set_drift_ppm(5)
+        self.assertAlmostEqual(self.calculate(10), 10)
+        self.assertEqual(self.ntp.drift_ppm(), 5)
+
+    def test_single_sample_after_reset(self):
+        self.ntp.set_drift_tolerance(1)
+        self.calculate(10)
+        self.calculate(10)
+        self.assertAlmostEqual(self.ntp.drift_ppm(), 10)
+
+        # Setting the drift manually clears the samples
+        self.ntp.set_drift_ppm(5)
+        self.calculate(20)
+        self.assertEqual(self.ntp.drift_ppm(), 5)
+
+        # Setting the tolerance clears the samples too
+        self.calculate(20)
+        self.ntp.set_drift_tolerance(1)
+        self.calculate(30)
+        self.assertAlmostEqual(self.ntp.drift_ppm(), 20)
+
+    def test_scattered_samples(self):
+        self.ntp.set_drift_tolerance(1)
+        self.ntp.set_drift_ppm(5)
+        for ppm in (10, 20, 12, 25):
+            self.calculate(ppm)
+        self.assertEqual(self.ntp.drift_ppm(), 5)
+
+    def test_tight_samples(self):
+        self.ntp.set_drift_tolerance(1)
+        self.ntp.set_drift_ppm(5)
+        for ppm in (10, 10.5, 11):
+            self.calculate(ppm)
+        self.assertAlmostEqual(self.ntp.drift_ppm(), 10.5)
+
+    def test_base_class_is_not_changed(self):
+        self.ntp.set_drift_tolerance(1)
+
+        # The subclass shares the samples of its base class until it calculates a drift
+        class Ntp(self.ntp):
+            pass
+
+        self.calculate(10, Ntp)
+        self.calculate(10, Ntp)
+        self.assertEqual(self.ntp._drift_samples, [])
+        self.assertAlmostEqual(Ntp.drift_ppm(), 10)
+        self.assertEqual(self.ntp.drift_ppm(), 0)
+
+    def test_no_tolerance(self):
+        self.ntp.set_drift_tolerance(None)
+        self.ntp.set_drift_ppm(5)
+        self.calculate(10)
+        self.assertAlmostEqual(self.ntp.drift_ppm(), 10)
+        self.calculate(30)
+        self.assertAlmostEqual(self.ntp.drift_ppm(), 30)
+
+
+def ntp_response(request, seconds, stratum=2):
+    """ Build the response of an NTP server to a request. The server time is the same in T3 and T4 """
+
+    msg = bytearray(48)
+    msg[0] = 0x24  # Leap indicator 0, version 4, mode 4(server)
+    msg[1] = stratum
+    msg[24:32] = request[40:48]  # The transmit timestamp of the request is copied to the originate timestamp
+    struct.pack_into('!IIII', msg, 32, seconds, 0, seconds, 0)
+    return msg
+
+
+class FakeSocket:
+    """ Non-blocking UDP socket. Every request is answered by the server function of its host, which returns
+    a list with the datagrams to be received """
+
+    def __init__(self, servers):
+        self.servers = servers
+        self.sent = []
+        self.received = []
+        self.closed = False
+
+    def setblocking(self, flag):
+        pass
+
+    def sendto(self, msg, addr):
+        self.sent.append(addr[0])
+        self.received.extend(self.servers[addr[0]](bytes(msg)))
+
+    def readinto(self, buf):
+        data = self.received.pop(0)
+        if data is None:
+            return None
+        if isinstance(data, Exception):
+            raise data
+
+        buf[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        self.closed = True
+
+
+class FakePoll:
+    """ Poll object which advances the fake clock by the whole timeout when there is nothing to receive """
+
+    def __init__(self, test_case):
+        self.test_case = test_case
+        self.sockets = []
+
+    def register(self, s, event):
+        self.sockets.append(s)
+
+    def unregister(self, s):
+        self.sockets.remove(s)
+
+    def poll(self, timeout_ms):
+        events = [(s, 1) for s in self.sockets if s.received]
+        if not events:
+            self.test_case.now_ms += timeout_ms
+        return events
+
+
+class NtpTestCase(unittest.TestCase):
+    """ Base class for the tests that query NTP servers. Replaces the network and the clock with fakes """
+
+    def setUp(self):
+        self.now_ms = 0
+        self.servers = {}
+        self.logs = []
+        self.sockets = []
+
+        def socket(*args):
+            s = FakeSocket(self.servers)
+            self.sockets.append(s)
+            return s
+
+        self.patched = {
+            '_socket': socket,
+            '_poll': lambda: FakePoll(self),
+            '_getaddrinfo': lambda host, port: [(2, 2, 0, '', (host, port))],
+            '_ticks_ms': lambda: self.now_ms,
+            '_ticks_us': lambda: self.now_ms * 1000,
+        }
+        self.original = {name: getattr(ntp, name) for name in self.patched}
+        for name, value in self.patched.items():
+            setattr(ntp, name, value)
+
+        # Work on a subclass, so the class state of ntp.Ntp is not changed by the tests
+        class Ntp(ntp.Ntp):
+            _ntp_socket = None
+
+        Ntp.set_logger_callback(self.logs.append)
+        self.ntp = Ntp
+
+    def tearDown(self):
+        for name, value in self.original.items():
+            setattr(ntp, name, value)
+
+    def sent(self):
+        """ Get the hosts queried by all the sockets and clear them """
+
+        sent = []
+        for s in self.sockets:
+            sent.extend(s.sent)
+            s.sent = []
+        return sent
+
+    @staticmethod
+    def server(seconds, stratum=2):
+        """ NTP server, which answers every request with the given time """
+
+        return lambda request: [ntp_response(request, seconds, stratum)]
+
+    @staticmethod
+    def silent_server(request):
+        """ NTP server, which never answers """
+
+        return []
+
+
+class TestNtpTime(NtpTestCase):
+    """Unit tests for function ntp_time(cls, epoch)"""
+
+    def setUp(self):
+        super().setUp()
+        self.servers['b.com'] = self.server(3900000001)
+
+    @staticmethod
+    def echo_server(seconds, offset, value):
+        """ NTP server, which changes the sequence number(offset 24) or the host index(offset 28) echoed in its response """
+
+        def server(request):
+            msg = ntp_response(request, seconds)
+            struct.pack_into('!I', msg, offset, value)
+            return [msg]
+
+        return server
+
+    def test_first_valid_response_wins(self):
+        self.servers['a.com'] = self.server(3900000000, stratum=0)
+        self.servers['c.com'] = self.server(3900000002)
+        self.ntp.set_hosts(['a.com', 'b.com', 'c.com'])
+
+        self.assertEqual(self.ntp.ntp_time(ntp.Ntp.EPOCH_1900), (3900000001_000000, 0))
+        self.assertEqual(self.sent(), ['a.com', 'b.com', 'c.com'])
+        self.assertEqual(list(self.ntp.host_health()), ['a.com'])
+
+    def test_stale_sequence_is_dropped(self):
+        self.ntp.set_hosts(['a.com', 'b.com'])
+        self.ntp.ntp_time()
+
+        # A late response to the previous call carries its sequence number
+        self.servers['a.com'] = self.echo_server(3900000000, 24, self.ntp._ntp_sequence)
+        self.assertEqual(self.ntp.ntp_time(ntp.Ntp.EPOCH_1900)[0], 3900000001_000000)
+
+        self.ntp.set_hosts(['a.com'])
+        with self.assertRaises(RuntimeError):
+            self.ntp.ntp_time()
+
+    def test_out_of_range_index_is_dropped(self):
+        self.servers['a.com'] = self.echo_server(3900000000, 28, 2)
+        self.ntp.set_hosts(['a.com', 'b.com'])
+        self.assertEqual(self.ntp.ntp_time(ntp.Ntp.EPOCH_1900)[0], 3900000001_000000)
+
+        self.ntp.set_hosts(['a.com'])
+        with self.assertRaises(RuntimeError):
+            self.ntp.ntp_time()
+
+    def test_answered_host_is_ignored(self):
+        # The first response is invalid. The duplicate that follows must not be accepted
+        self.servers['a.com'] = lambda request: [ntp_response(request, 3900000000, stratum=0), ntp_response(request, 3800000000)]
+        self.ntp.set_hosts(['a.com', 'b.com'])
+        self.assertEqual(self.ntp.ntp_time(ntp.Ntp.EPOCH_1900)[0], 3900000001_000000)
+        self.assertEqual(list(self.ntp.host_health()), ['a.com'])
+
+        self.ntp.set_hosts(['a.com'])
+        with self.assertRaises(RuntimeError):
+            self.ntp.ntp_time()
+
+    def test_truncated_response(self):
+        # The host of a response is known only if it reaches the originate timestamp
+        self.servers['a.com'] = lambda request: [ntp_response(request, 3900000000)[:40]]
+        self.servers['b.com'] = lambda request: [ntp_response(request, 3900000001)[:20]]
+        self.servers['c.com'] = self.server(3900000002)
+        self.ntp.set_hosts(['a.com', 'b.com', 'c.com'])
+
+        self.assertEqual(self.ntp.ntp_time(ntp.Ntp.EPOCH_1900)[0], 3900000002_000000)
+        self.assertEqual(list(self.ntp.host_health()), ['a.com'])
+        self.assertEqual(self.logs, ['(NTP) Invalid packet length(40): Host(a.com)', '(NTP) Invalid packet length(20)'])
+
+    def test_receive_error(self):
+        self.servers['a.com'] = lambda request: [OSError(111)]
+        self.ntp.set_hosts(['a.com', 'b.com'])
+        self.assertEqual(self.ntp.ntp_time(ntp.Ntp.EPOCH_1900)[0], 3900000001_000000)
+        self.assertEqual(self.ntp.host_health(), {})
+
+    def test_nothing_to_receive(self):
+        # The socket is reported as ready, but readinto() has nothing to return
+        self.servers['a.com'] = lambda request: [None]
+        self.ntp.set_hosts(['a.com', 'b.com'])
+        self.assertEqual(self.ntp.ntp_time(ntp.Ntp.EPOCH_1900)[0], 3900000001_000000)
+
+    def test_socket_is_reused(self):
+        self.ntp.set_hosts(['b.com'])
+        self.ntp.ntp_time()
+        self.ntp.ntp_time()
+        self.assertEqual(len(self.sockets), 1)
+        self.assertFalse(self.sockets[0].closed)
+
+    def test_socket_is_closed_on_error(self):
+        self.ntp.set_hosts(['b.com'])
+        with self.assertRaises(ValueError):
+            self.ntp.ntp_time(7)
+        self.assertTrue(self.sockets[0].closed)
+
+        # The next call opens a new socket
+        self.ntp.ntp_time()
+        self.assertEqual(len(self.sockets), 2)
+
+    def test_address_cache(self):
+        resolved = []
+
+        def getaddrinfo(host, port):
+            resolved.append(host)
+            return [(2, 2, 0, '', (host, port))]
+
+        ntp._getaddrinfo = getaddrinfo
+        self.ntp.set_hosts(['b.com'])
+        self.ntp.ntp_time()
+        self.now_ms += 3599_000
+        self.ntp.ntp_time()
+        self.assertEqual(resolved, ['b.com'])
+
+        # The address expires after an hour
+        self.now_ms += 1000
+        self.ntp.ntp_time()
+        self.assertEqual(resolved, ['b.com'] * 2)
+
+        # After the tick counter wraps around, an expired address looks like it expires far in the future
+        self.now_ms -= 2 ** 30
+        self.ntp.ntp_time()
+        self.assertEqual(resolved, ['b.com'] * 3)
+
+    def test_without_poll(self):
+        # CPython on Windows has no select.poll()
+        ntp._poll = None
+        self.ntp.set_hosts(['b.com'])
+        with self.assertRaises(RuntimeError):
+            self.ntp.ntp_time()
+        self.assertEqual(self.sockets, [])
+
+    def test_timeout(self):
+        self.servers['a.com'] = self.silent_server
+        self.servers['b.com'] = self.silent_server
+        self.ntp.set_hosts(['a.com', 'b.com'])
+        with self.assertRaises(RuntimeError):
+            self.ntp.ntp_time()
+
+        # All the hosts share the timeout
+        self.assertEqual(self.now_ms, 1000)
+        self.assertEqual(self.ntp.host_health(), {'a.com': (1, 2000), 'b.com': (1, 2000)})
+
+
+class TestHostBackoff(NtpTestCase):
+    """Unit tests for the backoff of the failing hosts and function host_health(cls)"""
+
+    def test_backoff_doubles_up_to_max(self):
+        self.ntp.set_hosts(['a.com'])
+        for failures in range(1, 16):
+            self.ntp._host_failed('a.com')
+            self.assertEqual(self.ntp.host_health(), {'a.com': (failures, min(2 ** failures, 3600) * 1000)})
+
+    def test_success_resets_backoff(self):
+        self.servers['a.com'] = self.silent_server
+        self.ntp.set_hosts(['a.com'])
+        with self.assertRaises(RuntimeError):
+            self.ntp.ntp_time()
+        # The first failure skips the host for 2 sec
+        self.assertEqual(self.ntp.host_health(), {'a.com': (1, 2000)})
+
+        self.servers['a.com'] = self.server(3900000000)
+        self.ntp.ntp_time()
+        self.assertEqual(self.ntp.host_health(), {})
+
+    def test_backing_off_host_is_skipped(self):
+        self.servers['a.com'] = self.server(3900000000)
+        self.servers['b.com'] = self.server(3900000001)
+        self.ntp.set_hosts(['a.com', 'b.com'])
+        self.ntp._host_failed('a.com')
+
+        self.assertEqual(self.ntp.ntp_time(ntp.Ntp.EPOCH_1900)[0], 3900000001_000000)
+        self.assertEqual(self.sent(), ['b.com'])
+
+        # The host is queried again once its backoff expires
+        self.now_ms += 2000
+        self.assertEqual(self.ntp.ntp_time(ntp.Ntp.EPOCH_1900)[0], 3900000000_000000)
+        self.assertEqual(self.sent(), ['a.com', 'b.com'])
+
+    def test_all_hosts_backing_off_are_queried(self):
+        self.servers['a.com'] = self.server(3900000000)
+        self.servers['b.com'] = self.server(3900000001)
+        self.ntp.set_hosts(['a.com', 'b.com'])
+        self.ntp._host_failed('a.com')
+        self.ntp._host_failed('b.com')
+
+        self.ntp.ntp_time()
+        self.assertEqual(self.sent(), ['a.com', 'b.com'])
+
+    def test_base_class_is_not_changed(self):
+        self.servers['a.com'] = self.silent_server
+        base_backoff = ntp.Ntp._host_backoff
+        base_addr_cache = ntp.Ntp._host_addr_cache
+
+        # The subclass shares the state of its base class until it is changed
+        class Ntp(self.ntp):
+            _hosts = ('a.com',)
+
+        with self.assertRaises(RuntimeError):
+            Ntp.ntp_time()
+        self.assertEqual(list(Ntp.host_health()), ['a.com'])
+        self.assertIs(ntp.Ntp._host_backoff, base_backoff)
+        self.assertIs(ntp.Ntp._host_addr_cache, base_addr_cache)
+        self.assertEqual(ntp.Ntp.host_health(), {})
+
+    def test_host_health(self):
+        self.ntp.set_hosts(['a.com', 'b.com'])
+        self.assertEqual(self.ntp.host_health(), {})
+
+        self.ntp._host_failed('a.com')
+        self.ntp._host_failed('a.com')
+        self.now_ms += 1000
+        self.ntp._host_failed('b.com')
+        self.assertEqual(self.ntp.host_health(), {'a.com': (2, 3000), 'b.com': (1, 2000)})
+
+        # An expired backoff keeps the failure count, but reports no remaining time
+        self.now_ms += 3000
+        self.assertEqual(self.ntp.host_health(), {'a.com': (2, 0), 'b.com': (1, 0)})
+
+        # Setting the hosts clears the backoff
+        self.ntp.set_hosts(['a.com', 'b.com'])
+        self.assertEqual(self.ntp.host_health(), {})
+
+
 # Run the tests
-unittest.TextTestRunner().run(unittest.TestLoader().loadTestsFromTestCase(TestDayFromWeekAndWeekday))
+loader = unittest.TestLoader()
+unittest.TextTestRunner().run(unittest.TestSuite([loader.loadTestsFromTestCase(test_case) for test_case in (
+    TestDayFromWeekAndWeekday,
+    TestSecsToDtTuple,
+    TestValidateHost,
+    TestDst,
+    TestDriftTolerance,
+    TestNtpTime,
+    TestHostBackoff,
+)]))